@@ -3,14 +3,131 @@ import re
 import time
 import math
 import smtplib
+import functools
+import heapq
+import itertools
+import random
+import threading
 import datetime as dt
 from zoneinfo import ZoneInfo
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-import json
-
-import requests
+from email.message import EmailMessage
+from html import escape as _esc
+from urllib.parse import quote, urlsplit, parse_qs
+from operator import attrgetter
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import requests_cache
 import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    from yaml import CSafeLoader as SafeLoader  # libyaml C 解析器
+except ImportError:
+    from yaml import SafeLoader
+
+
+# -------------------------
+# HTTP：共享连接池 + 磁盘缓存 + OpenAlex 限速
+# -------------------------
+# 所有请求走同一个 Session：TCP/TLS 连接复用；池大小 ≥ 线程池并发数
+# 跨天变化很小的查询落盘缓存（http_cache.sqlite，由 workflow 的 actions/cache 保留）：
+#   - OpenAlex 按 DOI / openalex_id 取 work：7 天
+#   - Unpaywall：30 天（404 也缓存，反复查不到的 DOI 不再打 API）
+#   - S2 推荐（POST，按请求体区分）：1 天
+#   - OpenAlex 关键词搜索（最新/经典）：3 小时，当天重跑直接复用，隔天必然重新拉
+# 其余请求不缓存；ai4scholar（按次计费、返回带积分信息）用 filter_fn 排除，
+# 即使它的响应带 Cache-Control / Expires 也不会落盘
+# cache_control=True：服务器给了 Cache-Control 就以它为准，上面的 TTL 只是兜底；
+# 过期条目若带 ETag/Last-Modified，会自动发条件请求，304 时直接复用本地 body
+_SEARCH_URL = "api.openalex.org/works?search"  # 关键词搜索：URL 含每天变化的日期过滤
+SESSION = requests_cache.CachedSession(
+    "http_cache",
+    backend="sqlite",
+    expire_after=requests_cache.DO_NOT_CACHE,
+    urls_expire_after={
+        "api.openalex.org/works?filter=doi": 7 * 86400,
+        "api.openalex.org/works?filter=openalex_id": 7 * 86400,
+        "api.unpaywall.org": 30 * 86400,
+        "api.semanticscholar.org": 86400,
+        _SEARCH_URL: 3 * 3600,
+    },
+    allowable_codes=(200, 404),
+    allowable_methods=("GET", "HEAD", "POST"),
+    cache_control=True,
+    filter_fn=lambda r: not r.url.startswith("https://ai4scholar.net"),
+)
+# 429/5xx 由 adapter 统一重试（指数退避，服务器给了 Retry-After 就按它等）；
+# raise_on_status=False：重试用尽后把最后的响应交回来，仍由调用方 raise_for_status
+_RETRY = Retry(
+    total=3,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    raise_on_status=False,
+)
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=_RETRY))
+SESSION.headers["User-Agent"] = "tj-daily-brief/1.0"
+
+
+def set_contact_email(mailto: str):
+    """
+    OpenAlex polite pool 认 User-Agent 里的 mailto：放在 Session 头里，
+    所有请求自动带上，不必逐个加 mailto 查询参数（也不影响缓存 key）
+    """
+    if mailto:
+        SESSION.headers["User-Agent"] = f"tj-daily-brief/1.0 (mailto:{mailto})"
+
+
+def _is_search_url(url: str) -> bool:
+    # 缓存里存的 URL 参数已按字母序归一（search 不一定是第一个参数），不能直接匹配 _SEARCH_URL 前缀
+    u = urlsplit(url)
+    return u.netloc == "api.openalex.org" and u.path == "/works" and "search" in parse_qs(u.query)
+
+
+def purge_stale_searches():
+    """
+    只清过期的关键词搜索条目：它们的 URL 带每天变化的日期过滤，过期后不会再被读到，
+    留着只会让 http_cache.sqlite 在 actions/cache 里越滚越大（删除后 SQLite 后端会 VACUUM）
+    其余过期条目（DOI / openalex_id / Unpaywall 等）保留：带 ETag/Last-Modified 的下次走 304 复用
+    """
+    try:
+        keys = [r.cache_key for r in SESSION.cache.filter(valid=False, expired=True) if _is_search_url(r.url)]
+        if keys:
+            SESSION.cache.delete(*keys)
+        print(f"HTTP cache: purged {len(keys)} stale search entries")
+    except Exception as e:
+        print(f"HTTP cache cleanup failed: {e}")
+
+
+class TokenBucket:
+    """
+    线程安全的令牌桶：每秒补 rate 个令牌，最多攒 burst 个
+    桶里有令牌就立即放行（不额外等待）；空了就预支下一个令牌并睡到它补上为止，
+    并发线程各自排到不同的时刻，整体速率不超过 rate
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+
+
+# OpenAlex polite pool：≤10 req/s（并发线程共享）；允许启动时 5 个的小突发
+_OPENALEX_LIMIT = TokenBucket(10, burst=5)
 
 
 # -------------------------
@@ -18,18 +135,29 @@ import yaml
 # -------------------------
 def load_config(path="config.yml"):
     with open(path, "r", encoding="utf-8") as f:
-        return yaml.safe_load(f)
+        cfg = yaml.load(f, Loader=SafeLoader)
+    # 关键词在整个运行期间不变：只小写一次，避免每篇 work 重复 lower()
+    cfg["_kw_lower"] = tuple(k.lower() for k in cfg["keywords"])
+    cfg["_exclude_lower"] = tuple(k.lower() for k in cfg.get("exclude_keywords", []))
+    cfg["_kw_re"] = compile_keywords(cfg["_kw_lower"])
+    cfg["_kw_implied"] = keyword_implied(cfg["_kw_lower"])
+    cfg["_exclude_re"] = compile_keywords(cfg["_exclude_lower"])
+    return cfg
+
+
+@functools.lru_cache(maxsize=None)
+def _zone(tz: str) -> ZoneInfo:
+    return ZoneInfo(tz)
 
 
 def now_local(tz: str) -> dt.datetime:
-    return dt.datetime.now(ZoneInfo(tz))
+    return dt.datetime.now(_zone(tz))
 
 
 # def should_send_now(cfg) -> bool:
 #     # 只在本地指定小时发信（用于配合 UTC 15/16 双跑）
 #     return now_local(cfg["timezone"]).hour == int(cfg["send_hour_local"])
-def should_send_now(cfg) -> bool:
-    now = now_local(cfg["timezone"])
+def should_send_now(cfg, now: dt.datetime) -> bool:
     print(f"DEBUG tz={cfg['timezone']} now={now.isoformat()} hour={now.hour} send_hour_local={cfg['send_hour_local']}")
     return now.hour == int(cfg["send_hour_local"])
 
@@ -39,162 +167,273 @@ def should_send_now(cfg) -> bool:
 def reconstruct_abstract(inv_idx):
     if not inv_idx:
         return ""
-    pos2word = {}
-    for word, poses in inv_idx.items():
+    # 位置基本是稠密的 0..N-1：按最大位置开好列表直接按位放词，省掉排序
+    max_pos = max((p for poses in inv_idx.values() for p in poses), default=-1)
+    words = [""] * (max_pos + 1)
+    for w, poses in inv_idx.items():
         for p in poses:
-            pos2word[p] = word
-    return " ".join(pos2word[i] for i in sorted(pos2word))
+            words[p] = w
+    return " ".join(filter(None, words))
 
 
 def openalex_get(params):
-    r = requests.get("https://api.openalex.org/works", params=params, timeout=60)
+    """
+    OpenAlex 偶尔会 429（限流）或 5xx：由 SESSION 的 adapter 做指数退避重试
+    响应体（含 abstract_inverted_index，单页可达几百 KB）直接用 orjson 解析 bytes
+    """
+    _OPENALEX_LIMIT.acquire()
+    r = SESSION.get("https://api.openalex.org/works", params=params, timeout=60)
     r.raise_for_status()
-    return r.json()
+    return orjson.loads(r.content)
 
 
-def openalex_get_work_by_id(openalex_id: str, mailto: str = "") -> dict | None:
+def openalex_get_cursor(params, max_results: int | None = None) -> list[dict]:
+    """
+    cursor 分页：从 cursor=* 开始，沿 meta.next_cursor 翻页，
+    直到凑够 max_results 条（None 表示不设上限）或没有下一页
+    最后一页往往仍带 next_cursor：不满一页、或已取够 meta.count 就停，省掉一次空页请求
+    """
+    per_page = int(params.get("per_page", 25))  # OpenAlex 默认 25
+    results = []
+    cursor = "*"
+    while cursor and (max_results is None or len(results) < max_results):
+        data = openalex_get({**params, "cursor": cursor})
+        page = data.get("results", [])
+        results.extend(page)
+        meta = data.get("meta") or {}
+        count = meta.get("count")
+        if len(page) < per_page or (count is not None and len(results) >= count):
+            break
+        cursor = meta.get("next_cursor")
+    return results if max_results is None else results[:max_results]
+
+
+def openalex_get_works_by_ids(openalex_ids: list[str]) -> list[dict]:
     """
     openalex_id 通常长这样：
       https://openalex.org/Wxxxxxxxxx
-    我们把它转换为 API：
-      https://api.openalex.org/works/Wxxxxxxxxx
+    按 50 个一批用 filter=openalex_id:W1|W2|... 批量拉取，
+    代替每个 id 一次 /works/{id} 请求；返回顺序与输入一致，查不到的跳过
     """
-    if not openalex_id:
-        return None
-    oid = openalex_id.strip()
-    if oid.startswith("https://openalex.org/"):
-        work_id = oid.split("/")[-1]  # Wxxxx
+    work_ids = []
+    for oid in openalex_ids:
+        oid = (oid or "").strip()
+        if oid.startswith("https://openalex.org/"):
+            oid = oid.split("/")[-1]  # Wxxxx
+        if oid:
+            work_ids.append(oid)  # 也可能直接给 Wxxxx
+
+    by_id = {}
+    for w in openalex_get_batched("openalex_id", work_ids):
+        by_id[(w.get("id") or "").split("/")[-1]] = w
+
+    return [by_id[x] for x in work_ids if x in by_id]
+
+
+def openalex_get_batched(field: str, values: list[str]) -> list[dict]:
+    """
+    filter={field}:v1|v2|... 每 50 个值一批（OR 过滤）
+    一个值可能对应多条 work（OpenAlex 里同一 DOI 偶有重复记录），所以每批 per_page=200
+    并沿 cursor 翻页取全，不会因为命中数超过一页而静默丢结果
+    各批互不依赖：多于一批时并发发出（共享 SESSION 连接池与 _OPENALEX_LIMIT 限速），
+    结果按批次顺序拼接
+    """
+    params_list = [
+        {"filter": f"{field}:" + "|".join(values[i:i + 50]), "per_page": 200}
+        for i in range(0, len(values), 50)
+    ]
+    if len(params_list) <= 1:
+        batches = [openalex_get_cursor(p) for p in params_list]
     else:
-        work_id = oid  # 也可能直接给 Wxxxx
+        with ThreadPoolExecutor(max_workers=min(8, len(params_list))) as ex:
+            batches = list(ex.map(openalex_get_cursor, params_list))
+    return [w for batch in batches for w in batch]
 
-    url = f"https://api.openalex.org/works/{work_id}"
-    params = {}
-    if mailto:
-        params["mailto"] = mailto
-    r = requests.get(url, params=params, timeout=60)
-    if r.status_code == 404:
-        return None
-    r.raise_for_status()
-    return r.json()
+
+@functools.lru_cache(maxsize=4096)
+def bare_doi(doi_or_url: str) -> str:
+    """
+    输入可能是：
+      - https://doi.org/10.xxx/yyy  （OpenAlex 常见）
+      - DOI:10.xxx/yyy
+      - 10.xxx/yyy
+    输出统一为：10.xxx/yyy
+    DOI 的各种写法都先归一到这里（带缓存），normalize_doi / doi_to_s2_pid 在此基础上拼接
+    """
+    s = (doi_or_url or "").strip()
+    if not s:
+        return ""
+    s = s.lower().replace("doi:", "").strip()
+    s = s.replace("https://doi.org/", "").replace("http://doi.org/", "")
+    return s.strip()
 
 
+@functools.lru_cache(maxsize=4096)
 def normalize_doi(doi: str) -> str:
     """
     OpenAlex 的 doi 字段一般是完整 URL 形式：https://doi.org/...
     这里把用户输入的 DOI 规范成这种形式，便于 filter=doi:...
     """
-    d = (doi or "").strip()
-    if not d:
-        return ""
-    d = d.lower()
-    d = d.replace("doi:", "").strip()
-    if d.startswith("http://"):
-        d = "https://" + d[len("http://"):]
-    if d.startswith("https://doi.org/"):
-        return d
-    return "https://doi.org/" + d
+    d = bare_doi(doi)
+    return "https://doi.org/" + d if d else ""
 
 
-def openalex_find_work_by_doi(doi: str, mailto: str = "") -> dict | None:
+def openalex_find_works_by_dois(dois: list[str]) -> list[dict]:
     """
-    用 filter=doi:... 找到对应 work
+    用 filter=doi:d1|d2|... 批量找到对应 works（查不到的 DOI 直接没有结果）
+    同一 DOI 有多条 work 时只保留第一条（与逐个查 per_page=1 时一致）
     """
-    doi_url = normalize_doi(doi)
-    if not doi_url:
-        return None
-    params = {"filter": f"doi:{doi_url}", "per_page": 1}
-    if mailto:
-        params["mailto"] = mailto
-    data = openalex_get(params)
-    results = data.get("results", [])
-    return results[0] if results else None
-
+    doi_urls = list(dict.fromkeys(d for d in map(normalize_doi, dois) if d))
+    by_doi = {}
+    for w in openalex_get_batched("doi", doi_urls):
+        by_doi.setdefault(normalize_doi(w.get("doi") or ""), w)
+    return [by_doi[d] for d in doi_urls if d in by_doi]
 
-def pick_best_url(work: dict) -> str:
-    doi = work.get("doi")
-    if doi:
-        return doi
-    primary = (work.get("primary_location") or {}).get("landing_page_url")
-    if primary:
-        return primary
-    return work.get("id", "")
 
-
-def normalize(s: str) -> str:
-    return (s or "").lower()
+# -------------------------
+# 条目结构
+# -------------------------
+@dataclass(slots=True)
+class Work:
+    """enrich 之后的统一条目（OpenAlex / S2 共用）；排序、渲染都走属性访问"""
+    title: str
+    abstract: str
+    publication_year: int | None
+    publication_date: str | None
+    cited_by_count: int
+    venue: str
+    doi: str
+    url: str
+    relevance: int
+    bucket: str  # latest / classic / reco_oa / reco_s2
+    _tl: str  # 小写标题 / 摘要，规则摘要复用
+    _al: str
+    _key: str  # 去重 / seen 统一用这个 key
+    via: str = "official_s2"
+    # Unpaywall 补全（attach_fulltext_links 原地写回）
+    pdf_url: str = ""
+    oa_status: str = ""
+    oa_license: str = ""
+    oa_version: str = ""
+    oa_landing: str = ""
+    _brief_html: str | None = None  # card 渲染时懒计算
 
 
 # -------------------------
 # 相关性与规则摘要
 # -------------------------
-def relevance_score(title: str, abstract: str, keywords: list[str]) -> int:
-    t = normalize(title)
-    a = normalize(abstract)
-    score = 0
-    for kw in keywords:
-        k = kw.lower()
-        if k in t:
-            score += 3
-        elif k in a:
-            score += 1
-    return score
-
-
-def excluded(title: str, abstract: str, exclude_keywords: list[str]) -> bool:
-    t = normalize(title)
-    a = normalize(abstract)
-    return any(k.lower() in t or k.lower() in a for k in exclude_keywords)
-
-
-def extract_numbers(text: str) -> str:
-    hits = re.findall(r"(\d+(?:\.\d+)?\s*(?:°c|℃|k|%))", normalize(text))
-    uniq = []
-    for h in hits:
-        h = h.replace(" ", "")
-        if h not in uniq:
-            uniq.append(h)
+def compile_keywords(keys) -> re.Pattern:
+    """
+    把一组（已小写的）关键词编译成一个 alternation 正则，一次扫描代替 K 次 `in`
+    - 包在 lookahead 里：每个起点都试一次，不同起点的命中可以重叠
+    - 长词优先：同一起点只捕获最长的那个关键词（"vce(sat)" 命中时 "vce" 不会被捕获，
+      需要逐词计数时用 keyword_implied 补回）
+    - 空列表：返回永不匹配的模式
+    """
+    if not keys:
+        return re.compile(r"(?!)")
+    return re.compile(f"(?=({_alternation(keys)}))")
+
+
+def _alternation(keys) -> str:
+    return "|".join(re.escape(k) for k in sorted(keys, key=len, reverse=True))
+
+
+def keyword_implied(keys) -> dict[str, tuple[str, ...]]:
+    """
+    捕获到关键词 m 时，文本里必然也出现的关键词：m 自身 + 所有是 m 子串的关键词
+    同一起点被长词“挡住”的短词一定是长词的前缀，所以按这张表展开后，
+    命中集合与逐个 `k in text` 完全一致
+    """
+    keys = set(keys)
+    return {m: tuple(k for k in keys if k in m) for m in keys}
+
+
+def keyword_hits(text: str, kw_re: re.Pattern, implied: dict) -> set[str]:
+    """text 中出现的全部关键词（等价于 {k for k in keys if k in text}）"""
+    hits = set()
+    for m in set(kw_re.findall(text)):
+        hits.update(implied[m])
+    return hits
+
+
+def relevance_score(t: str, a: str, kw_re: re.Pattern, implied: dict) -> int:
+    """t / a：已小写的标题 / 摘要"""
+    # 每个关键词只计一次：标题命中 +3，否则摘要命中 +1
+    t_hits = keyword_hits(t, kw_re, implied)
+    a_hits = keyword_hits(a, kw_re, implied) - t_hits
+    return 3 * len(t_hits) + len(a_hits)
+
+
+def excluded(t: str, a: str, exclude_re: re.Pattern) -> bool:
+    """t / a：已小写的标题 / 摘要"""
+    return bool(exclude_re.search(t) or exclude_re.search(a))
+
+
+_NUM_RE = re.compile(r"(\d+(?:\.\d+)?\s*(?:°c|℃|k|%))")
+_SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
+
+
+def extract_numbers(a: str) -> str:
+    """a：已小写的摘要"""
+    # dict.fromkeys：保序去重，一次线性遍历
+    uniq = list(dict.fromkeys(h.replace(" ", "") for h in _NUM_RE.findall(a)))
     return ", ".join(uniq[:6])
 
 
-def guess_tags(text: str) -> list[str]:
-    t = normalize(text)
-    tags = []
-    mapping = [
-        ("TSEP", ["tsep", "temperature sensitive electrical parameter"]),
-        ("电参法(Vce/Vf/Rds)", ["vce", "vce(sat)", "vf", "forward voltage", "rds(on)"]),
-        ("电热模型/热阻抗", ["electro-thermal", "thermal impedance", "foster", "cauer"]),
-        ("滤波/估计", ["kalman", "ukf", "ekf", "observer", "state estimation"]),
-        ("器件:SiC", ["sic"]),
-        ("器件:IGBT", ["igbt"]),
-        ("模块/封装", ["power module", "module", "packaging"]),
-    ]
-    for name, keys in mapping:
-        if any(k in t for k in keys):
-            tags.append(name)
-    return tags[:4]
+_TAG_MAPPING = [
+    ("TSEP", ["tsep", "temperature sensitive electrical parameter"]),
+    ("电参法(Vce/Vf/Rds)", ["vce", "vce(sat)", "vf", "forward voltage", "rds(on)"]),
+    ("电热模型/热阻抗", ["electro-thermal", "thermal impedance", "foster", "cauer"]),
+    ("滤波/估计", ["kalman", "ukf", "ekf", "observer", "state estimation"]),
+    ("器件:SiC", ["sic"]),
+    ("器件:IGBT", ["igbt"]),
+    ("模块/封装", ["power module", "module", "packaging"]),
+]
+
+# 所有标签桶的关键词合成一个正则，一次 findall 扫完全文；
+# 再用 keyword_implied 补回同一起点被长词挡住的短词（可能属于别的桶），最后映射回桶
+_TAG_BUCKETS: dict[str, set[int]] = {}  # 关键词 -> 所属桶下标（同一个词可以属于多个桶）
+for _i, (_, _keys) in enumerate(_TAG_MAPPING):
+    for _k in _keys:
+        _TAG_BUCKETS.setdefault(_k, set()).add(_i)
+_TAG_RE = compile_keywords(_TAG_BUCKETS)
+_TAG_IMPLIED = keyword_implied(_TAG_BUCKETS)
+
 
+def guess_tags(t: str) -> list[str]:
+    """t：已小写的 标题 + 摘要"""
+    hits = set().union(*(_TAG_BUCKETS[k] for k in keyword_hits(t, _TAG_RE, _TAG_IMPLIED)))
+    return [_TAG_MAPPING[i][0] for i in sorted(hits)][:4]
 
-def human_brief_cn(title: str, abstract: str) -> str:
-    tags = guess_tags(title + " " + abstract)
-    nums = extract_numbers(abstract)
 
-    sents = re.split(r"(?<=[.!?])\s+", abstract.strip())
-    sents = [s for s in sents if len(s) > 40]
-    explain = " ".join(sents[:2]) if sents else "（摘要信息不足：建议点开链接快速判断是否与你的在线监测链路相关。）"
+def human_brief_cn(abstract: str, tl: str, al: str) -> list[str]:
+    """
+    tl / al：enrich 时已算好的小写标题 / 摘要（避免重复 lower）
+    返回若干行纯文本；拼接与 HTML 转义交给调用方
+    """
+    tags = guess_tags(tl + " " + al)
+    nums = extract_numbers(al) if al else ""
 
-    return "\n".join([
+    # 摘要不足 40 字符时不可能有合格句子：直接走兜底文案，省掉 split
+    # 只要前 2 个够长的句子：islice 拿够就停，不再过滤剩下的句子
+    sents = _SENT_SPLIT.split(abstract.strip()) if len(abstract) > 40 else []
+    sents = list(itertools.islice((s for s in sents if len(s) > 40), 2))
+    explain = " ".join(sents) if sents else "（摘要信息不足：建议点开链接快速判断是否与你的在线监测链路相关。）"
+
+    return [
         "一句话：这篇工作围绕结温在线估算/监测给出一条可实现的技术路径。",
         f"方法线索：{(' / '.join(tags)) if tags else '未从摘要里识别到明确方法关键词'}",
         f"可量化指标：{nums if nums else '摘要未给出明确数值（或需读全文/图表）'}",
         f"拆解：{explain}",
         "建议：如果你在做 TSEP 标定/在线估算链路/误差评估，这篇优先读；否则先收藏观察。"
-    ])
+    ]
 
 
 # -------------------------
 # 候选获取：关键词（最新/经典）
 # -------------------------
-def fetch_latest_and_classic(cfg, mailto: str):
+def fetch_latest_and_classic(cfg):
     query = cfg.get("search_query") or " ".join(cfg["keywords"][:6])
 
     today = dt.date.today()
@@ -203,21 +442,26 @@ def fetch_latest_and_classic(cfg, mailto: str):
 
     common_filter = "type:journal-article|proceedings-article"
 
-    base = {"search": query, "per_page": 50}
-    if mailto:
-        base["mailto"] = mailto
+    max_fetch = int(cfg.get("max_fetch", 50))
+    base = {"search": query, "per_page": min(max_fetch, 200)}  # OpenAlex per_page 上限 200
 
-    latest = openalex_get({
+    latest_params = {
         **base,
         "filter": f"from_publication_date:{from_date},{common_filter}",
         "sort": "publication_date:desc",
-    }).get("results", [])
-
-    classic = openalex_get({
+    }
+    classic_params = {
         **base,
         "filter": f"to_publication_date:{classic_to},{common_filter}",
         "sort": "cited_by_count:desc",
-    }).get("results", [])
+    }
+
+    # 两个查询互不依赖：并发发出，总耗时≈较慢的那个，而不是两者之和
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        latest_f = ex.submit(openalex_get_cursor, latest_params, max_fetch)
+        classic_f = ex.submit(openalex_get_cursor, classic_params, max_fetch)
+        latest = latest_f.result()
+        classic = classic_f.result()
 
     return latest, classic
 
@@ -238,7 +482,7 @@ def load_seed_dois(path: str) -> list[str]:
     return out
 
 
-def fetch_recommendations_from_seeds(cfg, mailto: str) -> list[dict]:
+def fetch_recommendations_from_seeds(cfg) -> list[dict]:
     """
     对每个 seed DOI：
       DOI -> OpenAlex work
@@ -255,12 +499,8 @@ def fetch_recommendations_from_seeds(cfg, mailto: str) -> list[dict]:
     all_ids: list[str] = []
     seed_doi_urls = set()
 
-    # 1) 每个 DOI 找到对应 work，并收集 related_works ids
-    for doi in pos:
-        w = openalex_find_work_by_doi(doi, mailto)
-        time.sleep(0.12)  # 轻微限速，减少被限流风险
-        if not w:
-            continue
+    # 1) 种子 DOI 批量查到对应 works（每 50 个一次请求），并收集 related_works ids
+    for w in openalex_find_works_by_dois(pos):
         doi_url = w.get("doi")
         if doi_url:
             seed_doi_urls.add(doi_url)
@@ -268,17 +508,9 @@ def fetch_recommendations_from_seeds(cfg, mailto: str) -> list[dict]:
         rel = w.get("related_works") or []
         all_ids.extend(rel[:max_related])
 
-    # 2) 拉回 related works 详情（逐个拉，量不大更稳）
+    # 2) 批量拉回 related works 详情（去重后每 50 个一次请求）
     recos = []
-    seen = set()
-    for oid in all_ids:
-        if oid in seen:
-            continue
-        seen.add(oid)
-        w = openalex_get_work_by_id(oid, mailto)
-        time.sleep(0.12)
-        if not w:
-            continue
+    for w in openalex_get_works_by_ids(list(dict.fromkeys(all_ids))):
         # 排除：负例 DOI、以及种子本身
         doi_url = w.get("doi") or ""
         if doi_url and (doi_url in neg or doi_url in seed_doi_urls):
@@ -302,18 +534,63 @@ def s2_headers():
     return h
 
 
+@functools.lru_cache(maxsize=4096)
 def doi_to_s2_pid(doi: str) -> str:
     """
     把 DOI 规范成 Semantic Scholar 推荐接口常用的 paperId 形式：DOI:10.xxxx/xxxx
     """
-    d = (doi or "").strip()
-    d = d.replace("doi:", "").strip()
-    d = d.replace("https://doi.org/", "").strip()
-    d = d.replace("http://doi.org/", "").strip()
+    d = bare_doi(doi)
     return f"DOI:{d}" if d else ""
 
 
-def fetch_s2_recommendations_from_seeds(cfg) -> list[dict]:
+def load_seed_pids() -> tuple[list[str], list[str]]:
+    """
+    seeds_positive.txt / seeds_negative.txt -> S2 paperId 列表（DOI:10.xxxx/xxxx）
+    每次运行只读一次，ai4scholar 与官方 S2 共用
+    """
+    positive = [p for p in map(doi_to_s2_pid, load_seed_dois("seeds_positive.txt")) if p]
+    negative = [p for p in map(doi_to_s2_pid, load_seed_dois("seeds_negative.txt")) if p]
+    return positive, negative
+
+
+class BaseFirstRetry(Retry):
+    """
+    urllib3 2.x 的退避是 0, 2f, 4f, ...（第一次重试不等待），无 Retry-After 的 429 会被立刻重打；
+    这里改成 f, 2f, 4f, ...：第 n 次重试等 backoff_factor * 2^(n-1) 秒（与原手写退避一致）
+    """
+
+    def get_backoff_time(self) -> float:
+        # 与父类一致：只看最近一段连续错误（忽略重定向）
+        n = len(list(itertools.takewhile(lambda h: h.redirect_location is None, reversed(self.history))))
+        if n == 0:
+            return 0.0
+        backoff = self.backoff_factor * (2 ** (n - 1))
+        if self.backoff_jitter:
+            backoff += random.random() * self.backoff_jitter
+        return float(max(0, min(self.backoff_max, backoff)))
+
+
+def mount_s2_retry(cfg):
+    """
+    S2 / ai4scholar 推荐是 POST：单独挂一个允许 POST 重试的 adapter（按 host 前缀覆盖默认的 https://）
+    429/5xx 与网络错误最多重试 s2_retries 次，第 n 次等 s2_backoff_sec * 2^(n-1) 秒（+≤0.5 s 抖动），
+    即默认 5 s、10 s；服务器给了 Retry-After 就按它等
+    """
+    retry = BaseFirstRetry(
+        total=int(cfg.get("s2_retries", 2)),
+        backoff_factor=float(cfg.get("s2_backoff_sec", 3)),
+        backoff_jitter=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET", "POST"],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retry)
+    SESSION.mount("https://api.semanticscholar.org", adapter)
+    SESSION.mount("https://ai4scholar.net", adapter)
+
+
+def fetch_s2_recommendations_from_seeds(cfg, positive: list[str], negative: list[str]) -> list[dict]:
     """
     Semantic Scholar Recommendations API：
       POST https://api.semanticscholar.org/recommendations/v1/papers
@@ -321,28 +598,23 @@ def fetch_s2_recommendations_from_seeds(cfg) -> list[dict]:
 
     无 key：更可能 429/失败，所以这里做：
       - 小 limit
-      - 重试 + 指数退避
+      - 重试 + 指数退避（mount_s2_retry，尊重 Retry-After）
       - 失败直接返回空列表（不影响邮件）
     """
     if not cfg.get("use_s2_recommendations", True):
         return []
 
+    # 请求体只序列化一次：ai4scholar 与官方 S2、以及每次重试都复用同一份 bytes
+    payload = orjson.dumps({"positivePaperIds": positive, "negativePaperIds": negative})
+
+    mount_s2_retry(cfg)  # ai4scholar 与官方 S2 共用同一套 POST 重试策略
+
     # 先尝试 ai4scholar：成功就直接用它，跳过官方 S2
-    ok, recs = fetch_ai4s_recommendations_from_seeds(cfg)
+    ok, recs = fetch_ai4s_recommendations_from_seeds(cfg, positive, payload)
     if ok:
         print(f"AI4S: used, recs={len(recs)} (skip official S2)")
         return recs
 
-
-
-    
-    
-    pos = load_seed_dois("seeds_positive.txt")
-    neg = load_seed_dois("seeds_negative.txt")
-
-    positive = [doi_to_s2_pid(d) for d in pos if doi_to_s2_pid(d)]
-    negative = [doi_to_s2_pid(d) for d in neg if doi_to_s2_pid(d)]
-
     if not positive:
         return []
 
@@ -352,69 +624,34 @@ def fetch_s2_recommendations_from_seeds(cfg) -> list[dict]:
         "limit": int(cfg.get("s2_limit", 20)),
     }
 
-    payload = {"positivePaperIds": positive, "negativePaperIds": negative}
-
-    retries = int(cfg.get("s2_retries", 2))
-    base_backoff = int(cfg.get("s2_backoff_sec", 3))
-
-    for attempt in range(retries + 1):
-        try:
-            print(f"S2: start, positive={len(positive)}, negative={len(negative)}, limit={params['limit']}, has_key={bool((os.getenv('S2_API_KEY') or '').strip())}")
-            r = requests.post(
-                url,
-                headers=s2_headers(),
-                params=params,
-                data=json.dumps(payload),
-                timeout=60,
-            )
-
-            # 429/5xx：重试（无 key 时更常见） [oai_citation:6‡Semantic Scholar](https://www.semanticscholar.org/product/api%2Ftutorial?utm_source=chatgpt.com)
-            if r.status_code == 429 or 500 <= r.status_code < 600:
-                if attempt < retries:
-                    sleep_s = base_backoff * (2 ** attempt)
-                    print(f"S2 rate-limited or server error ({r.status_code}); retry in {sleep_s}s")
-                    time.sleep(sleep_s)
-                    continue
-                print(f"S2 failed with status={r.status_code}; skipping.")
-                return []
-
-            r.raise_for_status()
-            data = r.json()
-            recs = data.get("recommendedPapers", []) or []
-            print(f"S2: ok, status={r.status_code}, recs={len(recs)}")
-            return recs
-            return data.get("recommendedPapers", []) or []
-
-        except Exception as e:
-            if attempt < retries:
-                sleep_s = base_backoff * (2 ** attempt)
-                print(f"S2 exception: {e}; retry in {sleep_s}s")
-                time.sleep(sleep_s)
-                continue
-            print(f"S2 exception: {e}; skipping.")
+    try:
+        print(f"S2: start, positive={len(positive)}, negative={len(negative)}, limit={params['limit']}, has_key={bool((os.getenv('S2_API_KEY') or '').strip())}")
+        r = SESSION.post(
+            url,
+            headers=s2_headers(),
+            params=params,
+            data=payload,
+            timeout=60,
+        )
+
+        # 429/5xx 已由 adapter 重试（无 key 时更常见） [oai_citation:6‡Semantic Scholar](https://www.semanticscholar.org/product/api%2Ftutorial?utm_source=chatgpt.com)
+        if r.status_code == 429 or 500 <= r.status_code < 600:
+            print(f"S2 failed with status={r.status_code}; skipping.")
             return []
 
-    return []
+        r.raise_for_status()
+        data = orjson.loads(r.content)
+        recs = data.get("recommendedPapers", []) or []
+        print(f"S2: ok, status={r.status_code}, recs={len(recs)}")
+        return recs
 
+    except Exception as e:
+        print(f"S2 exception: {e}; skipping.")
+        return []
 
 
 
 
-def bare_doi(doi_or_url: str) -> str:
-    """
-    输入可能是：
-      - https://doi.org/10.xxx/yyy  （OpenAlex 常见）
-      - DOI:10.xxx/yyy
-      - 10.xxx/yyy
-    输出统一为：10.xxx/yyy
-    """
-    s = (doi_or_url or "").strip()
-    if not s:
-        return ""
-    s = s.lower().replace("doi:", "").strip()
-    s = s.replace("https://doi.org/", "").replace("http://doi.org/", "")
-    return s.strip()
-
 
 def unpaywall_lookup(doi_or_url: str, email: str, timeout: int = 20) -> dict | None:
     """
@@ -425,14 +662,14 @@ def unpaywall_lookup(doi_or_url: str, email: str, timeout: int = 20) -> dict | N
         return None
 
     url = f"https://api.unpaywall.org/v2/{doi}"
-    r = requests.get(url, params={"email": email}, timeout=timeout)
+    r = SESSION.get(url, params={"email": email}, timeout=timeout)
     if r.status_code == 404:
         return None
     r.raise_for_status()
-    return r.json()
+    return orjson.loads(r.content)
 
 
-def attach_fulltext_links(cfg, items: list[dict]) -> list[dict]:
+def attach_fulltext_links(cfg, items: list[Work]) -> list[Work]:
     """
     给每条记录补：
       - pdf_url（若有）
@@ -444,34 +681,33 @@ def attach_fulltext_links(cfg, items: list[dict]) -> list[dict]:
         print("Unpaywall: UNPAYWALL_EMAIL missing; skip fulltext enrichment.")
         return items
 
-    cache: dict[str, dict] = {}
-    for it in items:
-        d = bare_doi(it.get("doi") or "")
-        if not d:
-            continue
+    timeout = int(cfg.get("unpaywall_timeout", 20))
 
-        if d in cache:
-            data = cache[d]
-        else:
-            try:
-                data = unpaywall_lookup(d, email, timeout=int(cfg.get("unpaywall_timeout", 20)))
-            except Exception as e:
-                print(f"Unpaywall error for DOI {d}: {e}")
-                data = None
-            cache[d] = data or {}
-            time.sleep(0.12)  # 轻微限速，礼貌一点
+    def lookup(d: str) -> dict:
+        try:
+            return unpaywall_lookup(d, email, timeout=timeout) or {}
+        except Exception as e:
+            print(f"Unpaywall error for DOI {d}: {e}")
+            return {}
+
+    # 所有列表的 DOI 先合并去重，再并发查询（共享 SESSION；命中磁盘缓存的不走网络）
+    dois = list(dict.fromkeys(d for d in (bare_doi(it.doi) for it in items) if d))
+    with ThreadPoolExecutor(max_workers=8) as ex:
+        doi2oa = dict(zip(dois, ex.map(lookup, dois)))
 
+    for it in items:
+        data = doi2oa.get(bare_doi(it.doi))
         if not data:
             continue
 
         best = data.get("best_oa_location") or {}
         pdf = best.get("url_for_pdf") or ""   # 字段名在 Unpaywall schema/支持文档里列出  [oai_citation:6‡Unpaywall](https://support.unpaywall.org/support/solutions/articles/44002142311-what-do-the-fields-in-the-api-response-and-snapshot-records-mean-)
         landing = best.get("url_for_landing_page") or ""
-        it["pdf_url"] = pdf or ""
-        it["oa_status"] = data.get("oa_status") or ""
-        it["oa_license"] = best.get("license") or ""
-        it["oa_version"] = best.get("version") or ""
-        it["oa_landing"] = landing or ""
+        it.pdf_url = pdf or ""
+        it.oa_status = data.get("oa_status") or ""
+        it.oa_license = best.get("license") or ""
+        it.oa_version = best.get("version") or ""
+        it.oa_landing = landing or ""
 
     return items
 
@@ -488,7 +724,7 @@ def ai4s_headers():
     return {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
 
 
-def fetch_ai4s_recommendations_from_seeds(cfg) -> tuple[bool, list[dict]]:
+def fetch_ai4s_recommendations_from_seeds(cfg, positive: list[str], payload: bytes) -> tuple[bool, list[dict]]:
     """
     ai4scholar 优先入口：
     - 成功（HTTP 200）=> 返回 (True, recs)，并“跳过”官方 S2
@@ -502,10 +738,6 @@ def fetch_ai4s_recommendations_from_seeds(cfg) -> tuple[bool, list[dict]]:
     if not headers:
         return (False, [])
 
-    pos = load_seed_dois("seeds_positive.txt")
-    neg = load_seed_dois("seeds_negative.txt")
-    positive = [doi_to_s2_pid(d) for d in pos if doi_to_s2_pid(d)]
-    negative = [doi_to_s2_pid(d) for d in neg if doi_to_s2_pid(d)]
     if not positive:
         return (True, [])  # 有 key 但没有正例：视为“成功但无输出”，跳过官方 S2
 
@@ -515,58 +747,35 @@ def fetch_ai4s_recommendations_from_seeds(cfg) -> tuple[bool, list[dict]]:
         "fields": "title,abstract,year,citationCount,venue,externalIds,url",
         "limit": int(cfg.get("s2_limit", 20)),
     }
-    payload = {"positivePaperIds": positive, "negativePaperIds": negative}
+    try:
+        r = SESSION.post(url, headers=headers, params=params, data=payload, timeout=60)
 
-    retries = int(cfg.get("s2_retries", 2))
-    base_backoff = int(cfg.get("s2_backoff_sec", 3))
+        # 打印积分信息（ai4scholar 示例里提到这些 headers） [oai_citation:3‡Awesomely](https://ai4scholar.net/docs/code-examples)
+        if r.status_code == 200:
+            rem = r.headers.get("X-Credits-Remaining")
+            charged = r.headers.get("X-Credits-Charged")
+            print(f"AI4S: ok, remaining={rem}, charged={charged}")
 
-    for attempt in range(retries + 1):
-        try:
-            r = requests.post(url, headers=headers, params=params, data=json.dumps(payload), timeout=60)
-
-            # 打印积分信息（ai4scholar 示例里提到这些 headers） [oai_citation:3‡Awesomely](https://ai4scholar.net/docs/code-examples)
-            if r.status_code == 200:
-                rem = r.headers.get("X-Credits-Remaining")
-                charged = r.headers.get("X-Credits-Charged")
-                print(f"AI4S: ok, remaining={rem}, charged={charged}")
-
-                data = r.json()
-                # 兼容两种可能的返回结构：recommendedPapers（S2风格） 或 data（ai4s风格）
-                recs = data.get("recommendedPapers", None)
-                if recs is None:
-                    recs = data.get("data", []) or []
-
-                # 标记来源，便于你在邮件里显示“via ai4scholar”
-                for p in recs:
-                    if isinstance(p, dict):
-                        p["_via"] = "ai4scholar"
-
-                return (True, recs)
-
-            # 429/5xx：重试
-            if r.status_code == 429 or 500 <= r.status_code < 600:
-                if attempt < retries:
-                    sleep_s = base_backoff * (2 ** attempt)
-                    print(f"AI4S: {r.status_code}; retry in {sleep_s}s")
-                    time.sleep(sleep_s)
-                    continue
-                print(f"AI4S: failed status={r.status_code}; fallback to official S2.")
-                return (False, [])
-
-            # 401/402/403 等：直接 fallback（401/402 在 ai4scholar 文档示例里有提到） [oai_citation:4‡Awesomely](https://ai4scholar.net/docs/code-examples)
-            print(f"AI4S: failed status={r.status_code}; fallback to official S2.")
-            return (False, [])
+            data = orjson.loads(r.content)
+            # 兼容两种可能的返回结构：recommendedPapers（S2风格） 或 data（ai4s风格）
+            recs = data.get("recommendedPapers", None)
+            if recs is None:
+                recs = data.get("data", []) or []
 
-        except Exception as e:
-            if attempt < retries:
-                sleep_s = base_backoff * (2 ** attempt)
-                print(f"AI4S: exception {e}; retry in {sleep_s}s")
-                time.sleep(sleep_s)
-                continue
-            print(f"AI4S: exception {e}; fallback to official S2.")
-            return (False, [])
+            # 标记来源，便于你在邮件里显示“via ai4scholar”
+            for p in recs:
+                if isinstance(p, dict):
+                    p["_via"] = "ai4scholar"
+
+            return (True, recs)
 
-    return (False, [])
+        # 429/5xx（adapter 重试用尽）、401/402/403 等：直接 fallback（401/402 在 ai4scholar 文档示例里有提到） [oai_citation:4‡Awesomely](https://ai4scholar.net/docs/code-examples)
+        print(f"AI4S: failed status={r.status_code}; fallback to official S2.")
+        return (False, [])
+
+    except Exception as e:
+        print(f"AI4S: exception {e}; fallback to official S2.")
+        return (False, [])
 
 
 
@@ -577,35 +786,59 @@ def fetch_ai4s_recommendations_from_seeds(cfg) -> tuple[bool, list[dict]]:
 # -------------------------
 # enrich / 去重 / 排序
 # -------------------------
-def enrich(cfg, works: list[dict], tag: str = "") -> list[dict]:
+def enrich(cfg, works: list[dict], tag: str = "", skip=()) -> list[Work]:
+    """
+    skip：已发过的 key（seen 历史）。列表内去重与 seen 过滤都在还原摘要之前按 key 做，
+    重复 / 已发过的 work 不再白白还原摘要、算相关度
+    """
+    exclude_re = cfg["_exclude_re"]
     out = []
+    keys = set()
     for w in works:
+        # primary_location 只取一次：venue 与 url（DOI > 落地页 > OpenAlex id）共用
+        primary = w.get("primary_location") or {}
         title = w.get("title") or ""
+        url = w.get("doi") or primary.get("landing_page_url") or w.get("id") or ""
+        key = url or title  # 与 Work._key 同义：doi or url or title
+        if not key or key in keys or key in skip:
+            continue
+
+        tl = title.lower()
+        # 先只看标题：标题已命中排除词就不必再还原摘要
+        if exclude_re.search(tl):
+            continue
         abstract = reconstruct_abstract(w.get("abstract_inverted_index"))
-        if excluded(title, abstract, cfg.get("exclude_keywords", [])):
+        al = abstract.lower()
+        if exclude_re.search(al):
             continue
 
-        out.append({
-            "title": title,
-            "abstract": abstract,
-            "publication_year": w.get("publication_year"),
-            "publication_date": w.get("publication_date"),
-            "cited_by_count": w.get("cited_by_count", 0) or 0,
-            "venue": (((w.get("primary_location") or {}).get("source") or {}).get("display_name")) or "",
-            "doi": w.get("doi"),
-            "url": pick_best_url(w),
-            "relevance": relevance_score(title, abstract, cfg["keywords"]),
-            "bucket": tag,  # latest / classic / reco
-            "via": w.get("_via", "official_s2"),
-        })
+        source = primary.get("source") or {}
+
+        keys.add(key)
+        out.append(Work(
+            title=title,
+            abstract=abstract,
+            publication_year=w.get("publication_year"),
+            publication_date=w.get("publication_date"),
+            cited_by_count=w.get("cited_by_count", 0) or 0,
+            venue=source.get("display_name") or "",
+            doi=w.get("doi") or "",
+            url=url,
+            relevance=relevance_score(tl, al, cfg["_kw_re"], cfg["_kw_implied"]),
+            bucket=tag,
+            _tl=tl,
+            _al=al,
+            _key=key,
+            via=w.get("_via", "official_s2"),
+        ))
     return out
 
 
-def dedupe(items: list[dict]) -> list[dict]:
+def dedupe(items: list[Work]) -> list[Work]:
     seen = set()
     out = []
     for it in items:
-        key = it.get("doi") or it.get("url") or it.get("title")
+        key = it._key
         if not key or key in seen:
             continue
         seen.add(key)
@@ -617,84 +850,88 @@ def load_seen(path="seen.json") -> dict:
     if not os.path.exists(path):
         return {}
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(path, "rb") as f:
+            return orjson.loads(f.read())
     except Exception:
         return {}
     
 
 
 def save_seen(seen: dict, path="seen.json"):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(seen, f, ensure_ascii=False, indent=2)
+    # 先写临时文件再 os.replace：中途崩溃也不会留下截断的 seen.json
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(seen))
+    os.replace(tmp, path)
 
 
-def filter_seen(cfg, items: list[dict], seen: dict) -> list[dict]:
-    keep_days = int(cfg.get("seen_days_keep", 30))
-    today = dt.date.today()
-
-    # 清理过期记录
+def expire_seen(seen: dict, keep_days: int) -> dict:
+    """
+    清理过期记录：每次运行只在 load_seen 之后做一次
+    值存 date.toordinal()（整数，免去逐条解析）；兼容旧版 seen.json 里的 ISO 日期字符串
+    """
+    cutoff = dt.date.today().toordinal() - keep_days
     cleaned = {}
     for k, v in seen.items():
-        try:
-            d = dt.date.fromisoformat(v)
-            if (today - d).days <= keep_days:
-                cleaned[k] = v
-        except Exception:
-            pass
-    seen.clear()
-    seen.update(cleaned)
-
-    out = []
-    for it in items:
-        key = it.get("doi") or it.get("url") or it.get("title")
-        if not key:
-            continue
-        if key in seen:
-            continue
-        out.append(it)
-    return out
+        if isinstance(v, str):
+            try:
+                v = dt.date.fromisoformat(v).toordinal()
+            except ValueError:
+                continue
+        if isinstance(v, int) and v >= cutoff:
+            cleaned[k] = v
+    return cleaned
 
 
 
 
-def pick_top(items: list[dict], n: int) -> list[dict]:
+def pick_top(items: list[Work], n: int) -> list[Work]:
     # 简单可用：相关性优先，再看引用数
-    items = sorted(items, key=lambda x: (x["relevance"], x["cited_by_count"]), reverse=True)
-    return items[:n]
+    return heapq.nlargest(n, items, key=attrgetter("relevance", "cited_by_count"))
 
 
-def pick_top_cited(items: list[dict], n: int) -> list[dict]:
-    return sorted(items, key=lambda x: x.get("cited_by_count", 0), reverse=True)[:n]
+def pick_top_cited(items: list[Work], n: int) -> list[Work]:
+    return heapq.nlargest(n, items, key=attrgetter("cited_by_count"))
 
 
-def enrich_s2(cfg, papers: list[dict], tag: str = "reco_s2") -> list[dict]:
+def enrich_s2(cfg, papers: list[dict], tag: str = "reco_s2", skip=()) -> list[Work]:
+    """skip / 去重同 enrich：按 key 在打分之前过滤"""
     out = []
+    keys = set()
     for p in papers:
         title = p.get("title") or ""
-        abstract = p.get("abstract") or ""
-
-        if excluded(title, abstract, cfg.get("exclude_keywords", [])):
-            continue
-
         ext = p.get("externalIds") or {}
         doi = ext.get("DOI") or ""
         doi_url = f"https://doi.org/{doi}" if doi else ""
 
         url = p.get("url") or doi_url
+        key = doi_url or url or title
+        if not key or key in keys or key in skip:
+            continue
 
-        out.append({
-            "title": title,
-            "abstract": abstract,
-            "publication_year": p.get("year"),
-            "publication_date": None,
-            "cited_by_count": p.get("citationCount", 0) or 0,
-            "venue": p.get("venue") or "",
-            "doi": doi_url,
-            "url": url or doi_url,
-            "relevance": relevance_score(title, abstract, cfg["keywords"]),
-            "bucket": tag,  # reco_s2
-        })
+        abstract = p.get("abstract") or ""
+        tl, al = title.lower(), abstract.lower()
+
+        if excluded(tl, al, cfg["_exclude_re"]):
+            continue
+
+        keys.add(key)
+        out.append(Work(
+            title=title,
+            abstract=abstract,
+            publication_year=p.get("year"),
+            publication_date=None,
+            cited_by_count=p.get("citationCount", 0) or 0,
+            venue=p.get("venue") or "",
+            doi=doi_url,
+            url=url,
+            relevance=relevance_score(tl, al, cfg["_kw_re"], cfg["_kw_implied"]),
+            bucket=tag,
+            _tl=tl,
+            _al=al,
+            _key=key,
+            via=p.get("_via", "official_s2"),  # ai4scholar 返回的条目带 _via 标记
+        ))
     return out
 
 
@@ -702,88 +939,127 @@ def enrich_s2(cfg, papers: list[dict], tag: str = "reco_s2") -> list[dict]:
 # -------------------------
 # 邮件 HTML
 # -------------------------
-def build_html(
-    cfg,
-    latest: list[dict],
-    classic: list[dict],
-    reco_s2: list[dict],
-    reco_oa: list[dict],
-) -> str:
-    date_str = now_local(cfg["timezone"]).strftime("%Y-%m-%d (%a)")
-    build_sha = (os.getenv("GITHUB_SHA", "") or "")[:7]
-    run_id = os.getenv("GITHUB_RUN_ID", "")
-    
-    def card(it: dict) -> str:
-        brief = human_brief_cn(it["title"], it["abstract"]).replace("\n", "<br>")
-
-        # 来源标签
-        source_label = "关键词"
-        if it.get("bucket") == "reco_s2":
-            via = it.get("via", "official_s2")
-            source_label = "S2猜你喜欢(ai4scholar)" if via == "ai4scholar" else "S2猜你喜欢(官方)"
-        elif it.get("bucket") == "reco_oa":
-            source_label = "OpenAlex相关"
-        elif it.get("bucket") == "reco":
-            source_label = "推荐"
-        elif it.get("bucket") == "latest":
-            source_label = "最新"
-        elif it.get("bucket") == "classic":
-            source_label = "经典"
-
-        # 标题永远指向 DOI/落地页；PDF 作为可选按钮
-        doi_url = it.get("url") or ""
-        pdf_url = it.get("pdf_url") or ""
-
-        pdf_btn = ""
-        if pdf_url:
-            pdf_btn = f"""
+# 卡片模板只定义一次，渲染时 format_map 填空
+_PDF_BTN_TMPL = """
               <a href="{pdf_url}" target="_blank" rel="noreferrer"
                  style="display:inline-block;margin-left:8px;padding:2px 10px;border:1px solid #888;border-radius:999px;text-decoration:none;font-weight:600;">
                 PDF
               </a>
             """
 
-        return f"""
+_CARD_TMPL = """
         <div style="margin:14px 0;padding:12px;border:1px solid #ddd;border-radius:10px;">
           <div style="font-size:16px;font-weight:700;">
-            <a href="{doi_url}" target="_blank" rel="noreferrer">{it['title']}</a>
+            <a href="{url}" target="_blank" rel="noreferrer">{title}</a>
             {pdf_btn}
           </div>
           <div style="color:#555;margin-top:6px;">
-            {it['venue'] or 'Unknown venue'} · {it['publication_year'] or ''} · 引用 {it['cited_by_count']} · relevance {it['relevance']} · 来源 {source_label} · 全文 {"PDF" if pdf_url else "无"}
+            {venue} · {year} · 引用 {cited_by_count} · relevance {relevance} · 来源 {source_label} · 全文 {fulltext}
           </div>
-          <div style="margin-top:10px;line-height:1.55;">{brief}</div>
+          <div style="margin-top:10px;line-height:1.55;">{brief_html}</div>
         </div>
         """
 
 
-    reco_days = ""
-    return f"""
+# bucket -> 邮件里显示的来源标签
+_BUCKET_LABELS = {
+    "reco_oa": "OpenAlex相关",
+    "reco": "推荐",
+    "latest": "最新",
+    "classic": "经典",
+}
+_S2_VIA_LABELS = {"ai4scholar": "S2猜你喜欢(ai4scholar)"}
+
+
+def _href(url: str) -> str:
+    """
+    链接白名单：只放行 http(s)，其他 scheme（javascript: 等）一律返回空串；
+    放行的只编码空格等非法字符（RFC 3986 保留字符与已有 %xx 原样保留，
+    否则 a+b、;jsessionid=、(…) 会被改写、PDF 链接失效），再按 HTML 属性转义
+    """
+    if not url.startswith(("https://", "http://")):
+        return ""
+    return _esc(quote(url, safe=":/?#[]@!$&'()*+,;=%~"))
+
+
+def build_html(
+    cfg,
+    now: dt.datetime,
+    latest: list[Work],
+    classic: list[Work],
+    reco_s2: list[Work],
+    reco_oa: list[Work],
+) -> str:
+    date_str = now.strftime("%Y-%m-%d (%a)")
+    build_sha = (os.getenv("GITHUB_SHA", "") or "")[:7]
+    run_id = os.getenv("GITHUB_RUN_ID", "")
+    
+    def card(it: Work) -> str:
+        # 同一条目可能出现在多个列表里（对象共享）：brief 只算一次，缓存在条目上
+        brief = it._brief_html
+        if brief is None:
+            brief = it._brief_html = "<br>".join(
+                _esc(line) for line in human_brief_cn(it.abstract, it._tl, it._al)
+            )
+
+        # 来源标签（常量查表；S2 再按 via 区分 ai4scholar / 官方）
+        if it.bucket == "reco_s2":
+            source_label = _S2_VIA_LABELS.get(it.via, "S2猜你喜欢(官方)")
+        else:
+            source_label = _BUCKET_LABELS.get(it.bucket, "关键词")
+
+        # 标题永远指向 DOI/落地页；PDF 作为可选按钮（不合法的链接直接丢弃）
+        doi_url = _href(it.url)
+        pdf_url = _href(it.pdf_url)
+
+        return _CARD_TMPL.format_map({
+            "url": doi_url,
+            "title": _esc(it.title),
+            "pdf_btn": _PDF_BTN_TMPL.format_map({"pdf_url": pdf_url}) if pdf_url else "",
+            "venue": _esc(it.venue or "Unknown venue"),
+            "year": it.publication_year or "",
+            "cited_by_count": it.cited_by_count,
+            "relevance": it.relevance,
+            "source_label": source_label,  # 模块常量，无需转义
+            "fulltext": "PDF" if pdf_url else "无",
+            "brief_html": brief,
+        })
+
+
+    # 所有片段追加进一个列表，最后只 join 一次
+    parts = [f"""
     <html><body style="font-family:Arial, Helvetica, sans-serif;">
       <h2>{cfg['topic_cn']} — 每日科研简报（{date_str}）</h2>
       <p style="color:#666;">
         数据源：OpenAlex（works 搜索 + 引用数 + related_works 推荐）。建议带 OPENALEX_MAILTO 做 polite usage。<br>
         构建标识：sha={build_sha} run={run_id}
       </p>
-
-      <h3>⭐ S2猜你喜欢（更像“你可能也喜欢”）</h3>
-      {''.join(card(x) for x in reco_s2) if reco_s2 else '<p>S2 今天没有产出（或被跳过），不影响其他内容。</p>'}
-
-      <h3>🧭 OpenAlex脉络（沿你的种子论文相关图谱扩展）</h3>
-      {''.join(card(x) for x in reco_oa) if reco_oa else '<p>OpenAlex related_works 今天为空：检查 seeds_positive.txt DOI 是否有效。</p>'}
-
-      <h3>🆕 最新进展（近 {cfg['latest_days']} 天）</h3>
-      {''.join(card(x) for x in latest) if latest else '<p>今天未抓到足够匹配的最新条目。</p>'}
-
-      <h3>🏛️ 经典/高影响力（两年前及更早）</h3>
-      {''.join(card(x) for x in classic) if classic else '<p>今天未抓到足够匹配的经典条目。</p>'}
-
+"""]
+    sections = [
+        ("⭐ S2猜你喜欢（更像“你可能也喜欢”）", reco_s2,
+         "<p>S2 今天没有产出（或被跳过），不影响其他内容。</p>"),
+        ("🧭 OpenAlex脉络（沿你的种子论文相关图谱扩展）", reco_oa,
+         "<p>OpenAlex related_works 今天为空：检查 seeds_positive.txt DOI 是否有效。</p>"),
+        (f"🆕 最新进展（近 {cfg['latest_days']} 天）", latest,
+         "<p>今天未抓到足够匹配的最新条目。</p>"),
+        ("🏛️ 经典/高影响力（两年前及更早）", classic,
+         "<p>今天未抓到足够匹配的经典条目。</p>"),
+    ]
+    for heading, items, empty in sections:
+        parts.append(f"\n      <h3>{heading}</h3>\n      ")
+        if items:
+            parts.extend(card(x) for x in items)
+        else:
+            parts.append(empty)
+        parts.append("\n")
+    parts.append("""
       <hr>
       <p style="color:#888;font-size:12px;">
         下一阶段：接入 Semantic Scholar Recommendations（支持正/负例更懂你），并把摘要升级为“可选大模型生成（只对 Top-N 调用，控制 token 成本）”。
       </p>
     </body></html>
-    """
+    """)
+    return "".join(parts)
 
 
 def send_email(subject: str, html: str):
@@ -793,48 +1069,53 @@ def send_email(subject: str, html: str):
     pw = os.environ["SMTP_PASS"]
     to_email = os.environ["TO_EMAIL"]
 
-    msg = MIMEMultipart("alternative")
+    msg = EmailMessage()
     msg["Subject"] = subject
     msg["From"] = user
     msg["To"] = to_email
-    msg.attach(MIMEText(html, "html", "utf-8"))
-
-    with smtplib.SMTP(host, port) as s:
-        s.ehlo()
-        s.starttls()
+    msg.set_content("本邮件为 HTML 格式，请使用支持 HTML 的邮件客户端查看。")
+    msg.add_alternative(html, subtype="html")
+
+    # 465 是隐式 TLS：直接 SMTP_SSL，省掉 STARTTLS 那一轮往返；其余端口照旧 STARTTLS
+    # 先进 with 再握手：STARTTLS / 登录失败时连接也会被 QUIT 关闭
+    smtp_cls = smtplib.SMTP_SSL if port == 465 else smtplib.SMTP
+    with smtp_cls(host, port) as s:
+        if port != 465:
+            s.ehlo()
+            s.starttls()
         s.login(user, pw)
-        s.sendmail(user, [to_email], msg.as_string())
+        s.send_message(msg, from_addr=user, to_addrs=[to_email])
 
 
 def main():
     cfg = load_config()
-    if not should_send_now(cfg):
+    now = now_local(cfg["timezone"])  # 整个运行只取一次本地时间
+    if not should_send_now(cfg, now):
         print("Not sending now (local hour mismatch).")
         return
 
-    mailto = os.getenv("OPENALEX_MAILTO", "")
-    seen = load_seen()
+    set_contact_email(os.getenv("OPENALEX_MAILTO", ""))
+    seen = expire_seen(load_seen(), int(cfg.get("seen_days_keep", 30)))
     print(f"DEBUG seen loaded: {len(seen)}")
 
     # 1) 关键词：最新 + 经典
     # 1) 关键词：最新 + 经典
-    latest_raw, classic_raw = fetch_latest_and_classic(cfg, mailto)
-    latest_items = filter_seen(cfg, dedupe(enrich(cfg, latest_raw, "latest")), seen)
-    classic_items = filter_seen(cfg, dedupe(enrich(cfg, classic_raw, "classic")), seen)
+    latest_raw, classic_raw = fetch_latest_and_classic(cfg)
+    latest_items = enrich(cfg, latest_raw, "latest", seen)
+    classic_items = enrich(cfg, classic_raw, "classic", seen)
     latest = pick_top(latest_items, int(cfg["top_latest"]))
     classic = pick_top(classic_items, int(cfg["top_classic"]))
 
     # 2) Milestone B：DOI seeds -> related_works 推荐
     # OpenAlex 推荐（你已完成）
-    reco_oa_raw = fetch_recommendations_from_seeds(cfg, mailto)
-    reco_oa = dedupe(enrich(cfg, reco_oa_raw, "reco_oa"))
-    reco_oa = filter_seen(cfg,reco_oa,seen)
+    reco_oa_raw = fetch_recommendations_from_seeds(cfg)
+    reco_oa = enrich(cfg, reco_oa_raw, "reco_oa", seen)
     reco_oa = pick_top_cited(reco_oa, int(cfg.get("top_reco_oa", 10)))
     
     # S2 推荐（无 key 也尝试；失败会自动跳过）
-    reco_s2_raw = fetch_s2_recommendations_from_seeds(cfg)
-    reco_s2 = dedupe(enrich_s2(cfg, reco_s2_raw, "reco_s2"))
-    reco_s2 = filter_seen(cfg,reco_s2,seen)
+    pos_pids, neg_pids = load_seed_pids()
+    reco_s2_raw = fetch_s2_recommendations_from_seeds(cfg, pos_pids, neg_pids)
+    reco_s2 = enrich_s2(cfg, reco_s2_raw, "reco_s2", seen)
     reco_s2 = pick_top_cited(reco_s2, int(cfg.get("top_reco_s2", 10)))
     
     # 合并去重
@@ -842,30 +1123,30 @@ def main():
     
     # 轻微偏向 S2（因为更像“猜你喜欢”）；无 S2 数据也不影响
     for it in reco_all:
-        if it.get("bucket") == "reco_s2":
-            it["relevance"] += 2
+        if it.bucket == "reco_s2":
+            it.relevance += 2
     
     reco = pick_top(reco_all, int(cfg.get("top_reco", 3)))
 
-    latest = attach_fulltext_links(cfg, latest)
-    classic = attach_fulltext_links(cfg, classic)
-    reco_s2 = attach_fulltext_links(cfg, reco_s2)
-    reco_oa = attach_fulltext_links(cfg, reco_oa)
+    # 四个列表一起补全文链接：跨列表去重 DOI，一次并发查完（原地写回各条目）
+    attach_fulltext_links(cfg, latest + classic + reco_s2 + reco_oa)
 
-    html = build_html(cfg, latest, classic, reco_s2, reco_oa)
-    subject = f"[每日科研简报] {cfg['topic_cn']} | {now_local(cfg['timezone']).strftime('%Y-%m-%d')}"
+    html = build_html(cfg, now, latest, classic, reco_s2, reco_oa)
+    subject = f"[每日科研简报] {cfg['topic_cn']} | {now.strftime('%Y-%m-%d')}"
 
     send_email(subject, html)
-    today_str = dt.date.today().isoformat()
+    today_ord = dt.date.today().toordinal()
     for lst in [latest, classic, reco_s2, reco_oa]:
         for it in lst:
-            k = it.get("doi") or it.get("url") or it.get("title")
+            k = it._key
             if k:
-                seen[k] = today_str
+                seen[k] = today_ord
     save_seen(seen)
     print(f"DEBUG seen saved: {len(seen)}")
     print("Email sent.")
 
+    purge_stale_searches()
+
 
 if __name__ == "__main__":
     main()